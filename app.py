@@ -14,14 +14,29 @@ The type of the challenge as well as the challenge driving direction are defined
 - `/final/ccw` - the obstacle challenge round with counter-clockwise driving direction
 """
 
-from flask import Flask, make_response, render_template
+from flask import Flask, Response, abort, render_template, request
 import cv2
 import numpy as np
-from random import randint, choice, sample
+import random
 from enum import Enum
+from typing import NamedTuple
+from functools import lru_cache
+from itertools import permutations, product
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+import threading
+from queue import LifoQueue, Queue, Empty, Full
+from concurrent.futures import ThreadPoolExecutor
+import os
+import math
+import hashlib
+import struct
+import zlib
+import zipfile
+import io
+import re
 
 app = Flask(__name__)
-app.debug = True
 
 """
 ### General Game Mat description
@@ -170,24 +185,40 @@ T2---X1---T1
 # In order to be able to randomize the inner walls configuration as well as the obstacles positions,
 # it is necessary to define the main points of the game mat in pixels.
 
-# The size of the game mat is 3 meters by 3 meters, which is 3000 pixels by 3000 pixels.
+# The dimensions of the game elements are given in millimeters and converted to pixels
+# with the resolution of one pixel per `mm_per_pixel` millimeters. The picture is drawn
+# with one pixel per millimeter by default. A smaller picture, faster to draw and to encode,
+# can be chosen with the MM_PER_PIXEL environment variable, the walls and the lines stay
+# at least one pixel thick.
+mm_per_pixel = int(os.environ.get('MM_PER_PIXEL', '1'))
+if mm_per_pixel < 1:
+    raise ValueError('MM_PER_PIXEL must be a positive number of millimeters')
+
+def px(mm):
+    """
+    Convert the distance in millimeters to the number of pixels.
+    """
+
+    return round(mm / mm_per_pixel)
+
+# The size of the game mat is 3 meters by 3 meters.
 # The width and height do not include the outerwalls.
-width = 3000
+width = px(3000)
 height = width
 
-# The straightforward section is 1000x1000 pixels.
+# The straightforward section is 1 meter by 1 meter.
 # The field has 4 straightforward sections with the identical layout.
 # Due to the symmetry, it is enough to define coordinates of the elements for one section relative to the top left corner of the game mat (0,0).
 # The coordinates below are for the section labeled "Section N".
 
 # Arcs:
 # The first line is the first arc in the straightforward section.
-first_line = 400
+first_line = px(400)
 # The second line is the second arc in the straightforward section.
-second_line = first_line + 200
+second_line = first_line + px(200)
 
 # The inner border is the border between the straightforward section and the central section.
-inner_border = second_line + 400
+inner_border = second_line + px(400)
 
 # Radiuses:
 # The left radius is the left radius in the straightforward section.
@@ -198,56 +229,121 @@ middle_position = width // 2
 right_position = width - inner_border
 
 # Thickness of lines representing the walls
-border = 10
+border = max(px(10), 1)
 
 # Thickness of the lines representing the radiuses and arcs
-thin_line = 2
+thin_line = max(px(2), 1)
+
+def line_span(position, thickness):
+    """
+    Return the slice of pixels covered by the line of the given thickness drawn along
+    the given position. The position is relative to the game mat, the outer walls are
+    taken into account.
+    """
+
+    start = position - (thickness // 2) + border
+    return slice(start, start + thickness)
+
+# The game field is drawn as a single channel image where every pixel contains
+# the index of its color in the palette. The image with BGR colors is built from
+# the palette just before encoding.
+palette = []
+
+def palette_color(bgr):
+    """
+    Add the color given as the BGR tuple to the palette and return its index.
+    """
+
+    palette.append(bgr)
+    return len(palette) - 1
+
+# The color of the walls and the lines is black
+wall_color = palette_color((0, 0, 0))
+
+# The color of the game mat is white
+mat_color = palette_color((255, 255, 255))
 
 # The presentation of the challenge driving direction is a narrow arc
 # in the central section of the game mat.
-narrow_radius = 350
-narrow_color = (255, 0, 0) # The color is blue
-narrow_thickness = 20
+narrow_radius = px(350)
+narrow_color = palette_color((255, 0, 0)) # The color is blue
+narrow_thickness = px(20)
 
 # The color to mark the starting zone is grey
-start_section_color = (192, 192, 192)
+start_section_color = palette_color((192, 192, 192))
 
 # The color of parking lot barriers is magenta
-parking_lot_color = (255, 0, 255)
-parking_barrier_thickness = 20
-parking_barrier_length = 200
-distance_between_parking_barriers = 300
+parking_lot_color = palette_color((255, 0, 255))
+parking_barrier_thickness = px(20)
+parking_barrier_length = px(200)
+distance_between_parking_barriers = px(300)
+
+# The obstacle will be represented as a square with the side of 100 millimeters.
+obstacle_size = px(100)
+
+def fill_rectangle(img, top, left, bottom, right, c):
+    """
+    Fill the rectangle with the given color. The bottom and the right bounds are
+    exclusive as for slicing, the rectangle is filled by OpenCV.
+    """
+
+    cv2.rectangle(img, (left, top), (right - 1, bottom - 1), c, cv2.FILLED)
+
+def north_rectangle(h1, w1, h2, w2):
+    """
+    Return the absolute bounds (top, left, bottom, right) of the rectangle with the given relative coordinates in the Section N
+    """
+
+    return min(h1,h2)+border, min(w1,w2)+border, max(h1,h2)+border, max(w1,w2)+border
+
+def south_rectangle(h1, w1, h2, w2):
+    """
+    Return the absolute bounds (top, left, bottom, right) of the rectangle with the given relative coordinates in the Section S
+    """
+
+    return height-max(h1,h2)+border, width-max(w1,w2)+border, height-min(h1,h2)+border, width-min(w1,w2)+border
+
+def west_rectangle(h1, w1, h2, w2):
+    """
+    Return the absolute bounds (top, left, bottom, right) of the rectangle with the given relative coordinates in the Section W
+    """
+
+    return height-max(w1,w2)+border, min(h1,h2)+border, height-min(w1,w2)+border, max(h1,h2)+border
+
+def east_rectangle(h1, w1, h2, w2):
+    """
+    Return the absolute bounds (top, left, bottom, right) of the rectangle with the given relative coordinates in the Section E
+    """
 
-# The obstacle will be represented as a square with the side of 100 pixels.
-obstacle_size = 100
+    return min(w1,w2)+border, width-max(h1,h2)+border, max(w1,w2)+border, width-min(h1,h2)+border
 
 def on_north(img, h1, w1, h2, w2, c):
     """
     Draw a square with the given color and the given relative coordinates in the Section N
     """
 
-    img[min(h1,h2)+border:max(h1,h2)+border, min(w1,w2)+border:max(w1,w2)+border] = c
+    fill_rectangle(img, *north_rectangle(h1, w1, h2, w2), c)
 
 def on_south(img, h1, w1, h2, w2, c):
     """
     Draw a square with the given color and the given relative coordinates in the Section S
     """
 
-    img[height-max(h1,h2)+border:height-min(h1,h2)+border, width-max(w1,w2)+border:width-min(w1,w2)+border] = c
+    fill_rectangle(img, *south_rectangle(h1, w1, h2, w2), c)
 
 def on_west(img, h1, w1, h2, w2, c):
     """
     Draw a square with the given color and the given relative coordinates in the Section W
     """
 
-    img[height-max(w1,w2)+border:height-min(w1,w2)+border, min(h1,h2)+border:max(h1,h2)+border] = c
+    fill_rectangle(img, *west_rectangle(h1, w1, h2, w2), c)
 
 def on_east(img, h1, w1, h2, w2, c):
     """
     Draw a square with the given color and the given relative coordinates in the Section E
     """
 
-    img[min(w1,w2)+border:max(w1,w2)+border, width-max(h1,h2)+border:width-min(h1,h2)+border] = c
+    fill_rectangle(img, *east_rectangle(h1, w1, h2, w2), c)
 
 class Section(Enum):
     """
@@ -260,6 +356,24 @@ class Section(Enum):
     WEST = on_west
     EAST = on_east
 
+# All straightforward sections in the order used by the randomization process.
+# Cannot use list(Section) because elements of Section are functions.
+# The layouts of the seeds depend on this order, so it must not change (tests/test_seeds.py).
+straightforward_sections = [Section.NORTH, Section.WEST, Section.SOUTH, Section.EAST]
+
+# All 24 orders of the straightforward sections to assign them to the obstacles sets
+# with one random choice.
+straightforward_sections_permutations = list(permutations(straightforward_sections))
+
+# Functions returning the absolute bounds of a rectangle in the corresponding
+# straightforward section.
+section_rectangles = {
+    Section.NORTH: north_rectangle,
+    Section.SOUTH: south_rectangle,
+    Section.WEST: west_rectangle,
+    Section.EAST: east_rectangle
+}
+
 class Direction(Enum):
     CW = 'cw'
     CCW = 'ccw'
@@ -292,9 +406,9 @@ class Intersection(Enum):
     BottomRight = (inner_border, right_position)
 
 class Color(Enum):
-    RED = (55,39,238)
-    GREEN = (44, 214, 68)
-    UNDEFINED = (0,0,0)
+    RED = palette_color((55,39,238))
+    GREEN = palette_color((44, 214, 68))
+    UNDEFINED = wall_color
 
 class Obstacle:
     """
@@ -325,16 +439,18 @@ class Obstacle:
     def _color(self):
         return self.color.value
 
-    def draw(self, img: np.ndarray, section: Section):
+    def rectangle(self, section: Section):
         """
-        Draw a square obstacle in the straightforward section defined by the given function `section`
+        Return the absolute bounds (top, left, bottom, right) of the square obstacle
+        in the straightforward section defined by the given function `section`
         """
 
-        section(img,
+        return section_rectangles[section](
           self._x()-(obstacle_size//2), self._y()-(obstacle_size//2),
-          self._x()+(obstacle_size//2), self._y()+(obstacle_size//2),
-          self._color())
+          self._x()+(obstacle_size//2), self._y()+(obstacle_size//2))
 
+# The starting zones are chosen in the order of their definition, so the layouts of
+# the seeds depend on this order and it must not change (tests/test_seeds.py).
 class StartZone(Enum):
     Z1 = (Intersection.X1, Intersection.BottomRight)
     Z2 = (Intersection.T2, Intersection.BottomMiddle)
@@ -353,22 +469,22 @@ class StartZone(Enum):
 #   Z4: T2, T4
 forbidden_intersections_in_start_zone = {
     Direction.CW: {
-        StartZone.Z3: [Intersection.T1, Intersection.T3],
-        StartZone.Z4: [Intersection.X1, Intersection.X2]
+        StartZone.Z3: frozenset([Intersection.T1, Intersection.T3]),
+        StartZone.Z4: frozenset([Intersection.X1, Intersection.X2])
     },
     Direction.CCW: {
-        StartZone.Z3: [Intersection.X1, Intersection.X2],
-        StartZone.Z4: [Intersection.T2, Intersection.T4]
+        StartZone.Z3: frozenset([Intersection.X1, Intersection.X2]),
+        StartZone.Z4: frozenset([Intersection.T2, Intersection.T4])
     }
 }
 
 # According to the rules, these intersections in the straightforward section containing
 # the parking lot cannot be used for the obstacle placement.
-forbidden_intersections_in_parking_section = [
+forbidden_intersections_in_parking_section = frozenset([
     Intersection.T3,
     Intersection.T4,
     Intersection.X2
-]
+])
 
 class VehiclePosition:
     """
@@ -390,15 +506,31 @@ class VehiclePosition:
     def _bottom_right_y(self):
         return self.start_zone.value[1].value[1]
 
+    def rectangle(self, section: Section):
+        """
+        Return the absolute bounds (top, left, bottom, right) of the vehicle starting zone
+        in the straightforward section defined by the given function `section`
+        """
+
+        return section_rectangles[section](
+          self._top_left_x(), self._top_left_y(),
+          self._bottom_right_x(), self._bottom_right_y())
+
     def draw(self, img: np.ndarray, section: Section):
         """
         Draw a vehicle starting zone in the straightforward section defined by the given function `section`
         """
 
-        section(img,
-          self._top_left_x(), self._top_left_y(),
-          self._bottom_right_x(), self._bottom_right_y(),
-          start_section_color)
+        fill_rectangle(img, *start_zones_rectangles[(self.start_zone, section)], start_section_color)
+
+# The absolute bounds of every vehicle starting zone in every straightforward section.
+# The key is the starting zone and the section. The bounds are calculated once here
+# instead of unpacking the coordinates of the zone every time it is drawn.
+start_zones_rectangles = {
+    (start_zone, section): VehiclePosition(start_zone).rectangle(section)
+    for start_zone in StartZone
+    for section in section_rectangles
+}
 
 class InnerWall:
     """
@@ -453,38 +585,63 @@ class InnerWall:
         Draw the inner walls of the game mat.
         """
 
-        # default position of the inner walls
-        h_n = inner_border # Y coordinate of the northern inner wall
-        w_w = inner_border # X coordinate of the western inner wall
-        h_s = height - inner_border # Y coordinate of the southern inner wall
-        w_e = width - inner_border # X coordinate of the eastern inner wall
-        
-        # Adjust the position of the inner walls based on which side of the game mat
-        # the inner wall should be drawn closer to the outer walls - the wall is
-        # positioned along the second arc of the corresponding straightforward section.
-        if self.on_north():
-            h_n = second_line
-        if self.on_west():
-            w_w = second_line
-        if self.on_south():
-            h_s = height - second_line
-        if self.on_east():
-            w_e = width - second_line
-
-        # north
-        img[h_n-(border//2)+border:h_n+(border//2)+border,w_w-(border//2)+border:w_e+(border//2)+border] = (0,0,0)
-        # west
-        img[h_n-(border//2)+border:h_s+(border//2)+border,w_w-(border//2)+border:w_w+(border//2)+border] = (0,0,0)
-        # south
-        img[h_s-(border//2)+border:h_s+(border//2)+border,w_w-(border//2)+border:w_e+(border//2)+border] = (0,0,0)
-        # east
-        img[h_n-(border//2)+border:h_s+(border//2)+border,w_e-(border//2)+border:w_e+(border//2)+border] = (0,0,0)
+        for wall in inner_walls_regions[(self._north, self._west, self._south, self._east)]:
+            img[wall] = wall_color
+
+def get_inner_walls_regions(north: bool, west: bool, south: bool, east: bool):
+    """
+    Return the regions of the image (the pairs of slices) occupied by the inner walls.
+    The arguments tell on which sides of the game mat the inner wall is closer to the
+    outer wall.
+    """
+
+    # default position of the inner walls
+    h_n = inner_border # Y coordinate of the northern inner wall
+    w_w = inner_border # X coordinate of the western inner wall
+    h_s = height - inner_border # Y coordinate of the southern inner wall
+    w_e = width - inner_border # X coordinate of the eastern inner wall
+
+    # Adjust the position of the inner walls based on which side of the game mat
+    # the inner wall should be drawn closer to the outer walls - the wall is
+    # positioned along the second arc of the corresponding straightforward section.
+    if north:
+        h_n = second_line
+    if west:
+        w_w = second_line
+    if south:
+        h_s = height - second_line
+    if east:
+        w_e = width - second_line
+
+    north = line_span(h_n, border)
+    west = line_span(w_w, border)
+    south = line_span(h_s, border)
+    east = line_span(w_e, border)
+
+    return [
+        (north, slice(west.start, east.stop)), # north
+        (slice(north.start, south.stop), west), # west
+        (south, slice(west.start, east.stop)), # south
+        (slice(north.start, south.stop), east) # east
+    ]
+
+# The regions of the inner walls for all 16 combinations of the sides where the inner
+# wall is closer to the outer wall, so they are not calculated for every request.
+inner_walls_regions = {
+    sides: get_inner_walls_regions(*sides)
+    for sides in product([False, True], repeat=4)
+}
+
+# The inner walls in the default position, used in the Obstacle challenge rounds.
+default_inner_walls = InnerWall()
 
 # Randomization process operates with sets of obstacles.
 # Each element of the list defines relative positions of the obstacles in the
 # straightforward section.
 # The duplicates for Card 14, 15, 20, 21 are removed to have results more valuable
 # from evaluation point of view.
+# The layouts of the seeds depend on the order of the sets, so it must not change
+# (tests/test_seeds.py).
 obstacles_sets = [
     # Single intersection obstacles (T1)
     [Obstacle(Intersection.T1, Color.GREEN)],                                         # 0, Card 1
@@ -538,6 +695,27 @@ obstacles_sets = [
     [Obstacle(Intersection.T3, Color.RED), Obstacle(Intersection.T4, Color.GREEN)],   # 30, Card 35
     [Obstacle(Intersection.T3, Color.RED), Obstacle(Intersection.T4, Color.RED)],     # 31, Card 36
 ]
+
+def get_obstacle_region(obstacle: Obstacle, section: Section):
+    """
+    Return the region of the image (the pair of slices) occupied by the obstacle
+    placed in the given straightforward section.
+    """
+
+    top, left, bottom, right = obstacle.rectangle(section)
+    return slice(top, bottom), slice(left, right)
+
+# The regions and the colors of the obstacles of every obstacles set placed in every
+# straightforward section. The key is the index of the obstacles set and the section.
+# The positions are calculated once here instead of every time the obstacles are drawn.
+# The obstacles are small, so they are filled faster by slicing than by OpenCV.
+obstacles_sets_regions = {
+    (obstacles_set_index, section): [(get_obstacle_region(obstacle, section), obstacle._color())
+        for obstacle in obstacles_sets[obstacles_set_index]]
+    for obstacles_set_index in range(len(obstacles_sets))
+    for section in section_rectangles
+}
+
 # The randomization process says that at least one of the straightforward sections must
 # have at least one obstacle in the intersection labeled as "X2". The map contains indices
 # of the corresponding obstacle sets for the green and red obstacles.
@@ -549,6 +727,167 @@ mandatory_obstacles_sets = {
 # make to reduce risk when incomplete solutions solve the challenge.
 required_obstacles_sets = [ 21, 22, 27, 28 ]
 
+class ObstaclesSetProperties(NamedTuple):
+    """
+    Represents the properties of an obstacles set checked by the randomization process.
+    """
+
+    green_amount: int
+    red_amount: int
+    # The start zones which can be used in the section with the obstacles set
+    start_zones: tuple[StartZone, ...]
+    # Whether the obstacles set cannot be placed in the section with the parking lot
+    conflicts_with_parking_section: bool
+
+def get_obstacles_set_properties(obstacles_set: list[Obstacle], direction: Direction) -> ObstaclesSetProperties:
+    """
+    Calculate the properties of the obstacles set for the given driving direction.
+    """
+
+    # The set of intersections that will be in front of the vehicle in the start zone
+    # for the given driving direction.
+    forbidden_intersections = forbidden_intersections_in_start_zone[direction]
+
+    green_amount = 0
+    red_amount = 0
+    forbidden_start_zones = set()
+    conflicts_with_parking_section = False
+    for one_obstacle in obstacles_set:
+        if one_obstacle.is_green():
+            green_amount = green_amount + 1
+        elif one_obstacle.is_red():
+            red_amount = red_amount + 1
+        else:
+            raise ValueError("Unknown obstacle color")
+
+        # Check if the current obstacle would be in front of the vehicle
+        # for each possible starting zone in this section
+        for zone in forbidden_intersections:
+            if one_obstacle.position in forbidden_intersections[zone]:
+                forbidden_start_zones.add(zone)
+
+        # Check if the current obstacle's position is suitable for the
+        # section where the parking lot is located.
+        if one_obstacle.position in forbidden_intersections_in_parking_section:
+            conflicts_with_parking_section = True
+
+    # The zones are listed in the fixed order, the order of a set of enum members
+    # differs between processes and the same seed would give different layouts.
+    start_zones = tuple(zone for zone in (StartZone.Z3, StartZone.Z4) if zone not in forbidden_start_zones)
+
+    return ObstaclesSetProperties(green_amount, red_amount, start_zones, conflicts_with_parking_section)
+
+# The properties of every obstacles set for every driving direction. They depend only on
+# the obstacles sets, so they are calculated once here instead of for every chosen set.
+obstacles_sets_properties_in_direction = {
+    direction: [get_obstacles_set_properties(obstacles_set, direction) for obstacles_set in obstacles_sets]
+    for direction in Direction
+}
+
+# The indices of the obstacles sets which can be chosen for the remaining sections
+# for every pair of the mandatory and the required obstacles sets.
+remaining_obstacles_sets = {
+    (mandatory_obstacles_set, required_obstacles_set): [index for index in range(len(obstacles_sets))
+        if index != mandatory_obstacles_set and index != required_obstacles_set]
+    for mandatory_obstacles_set in mandatory_obstacles_sets.values()
+    for required_obstacles_set in required_obstacles_sets
+}
+
+class ObstaclesSetsCombination(NamedTuple):
+    """
+    Represents the obstacles sets chosen for the four straightforward sections.
+    """
+
+    # The indices of the mandatory, the required and two remaining obstacles sets
+    obstacles_sets: tuple[int, int, int, int]
+    # The valid start zones of the obstacles sets which have at least one valid start zone
+    start_zones: dict[int, tuple[StartZone, ...]]
+    # The indices of the obstacles sets which can be placed in the section with the parking lot
+    suitable_for_parking_section: tuple[int, ...]
+
+def get_obstacles_sets_combination(chosen_obstacles_sets_indices: tuple[int, int, int, int],
+                                   direction: Direction) -> ObstaclesSetsCombination:
+    """
+    Check the chosen obstacles sets for the given driving direction.
+
+    Returns the combination of the obstacles sets or None if the obstacles sets do not
+    satisfy the conditions of the randomization process.
+    """
+
+    # The properties of the obstacles sets for the given driving direction.
+    obstacles_sets_properties = obstacles_sets_properties_in_direction[direction]
+
+    # Calculate the number of obstacles, the number of green and red obstacles and
+    # the valid start zones for choosen obstacles sets.
+    start_zones = {}
+    obstacles_set_conflicting_with_parking_section = set()
+    green_amount = 0
+    red_amount = 0
+    for obstacles_set_index in chosen_obstacles_sets_indices:
+        properties = obstacles_sets_properties[obstacles_set_index]
+
+        green_amount = green_amount + properties.green_amount
+        red_amount = red_amount + properties.red_amount
+
+        # Keep only obstacle sets that have at least one valid start zone,
+        # the sets where both possible start zones are forbidden are skipped.
+        if properties.start_zones:
+            start_zones[obstacles_set_index] = properties.start_zones
+
+        if properties.conflicts_with_parking_section:
+            obstacles_set_conflicting_with_parking_section.add(obstacles_set_index)
+
+    obstacles_amount = green_amount + red_amount
+
+    # Get all obstacle sets that are suitable for the parking section.
+    obstacles_set_suitable_for_parking_section = tuple(index for index in chosen_obstacles_sets_indices
+        if index not in obstacles_set_conflicting_with_parking_section)
+
+    # The obstacles sets are suitable if the conditions are satisfied:
+    # - the difference between the number of green and red obstacles is not greater than one
+    # - the total number of obstacles is at least 5
+    # - there is at least one valid start zone for the given combination of obstacles
+    # - there is at least one obstacle set that is suitable for the parking section
+    satisfied = (abs(green_amount - red_amount) <= 1) and \
+        (obstacles_amount > 4) and \
+        (len(start_zones) > 0) and \
+        (len(obstacles_set_suitable_for_parking_section) > 0)
+    if not satisfied:
+        return None
+
+    return ObstaclesSetsCombination(chosen_obstacles_sets_indices, start_zones,
+        obstacles_set_suitable_for_parking_section)
+
+def get_valid_obstacles_sets_combinations(direction: Direction) -> list[ObstaclesSetsCombination]:
+    """
+    Return all combinations of the obstacles sets satisfying the conditions of the
+    randomization process for the given driving direction.
+
+    Every combination is the ordered choice of the mandatory set (by its color), the
+    required set and two different remaining sets. All such choices are equally likely,
+    so choosing uniformly among the valid ones gives the same distribution as drawing
+    the choices again until they satisfy the conditions.
+    """
+
+    combinations = []
+    for mandatory_obstacles_set in mandatory_obstacles_sets.values():
+        for required_obstacles_set in required_obstacles_sets:
+            remaining = remaining_obstacles_sets[(mandatory_obstacles_set, required_obstacles_set)]
+            for os1, os2 in permutations(remaining, 2):
+                combination = get_obstacles_sets_combination(
+                    (mandatory_obstacles_set, required_obstacles_set, os1, os2), direction)
+                if combination is not None:
+                    combinations.append(combination)
+    return combinations
+
+# All combinations of the obstacles sets satisfying the conditions of the randomization
+# process for every driving direction, so the request chooses one of them at once instead
+# of drawing the obstacles sets again until they satisfy the conditions.
+valid_obstacles_sets_combinations = {
+    direction: get_valid_obstacles_sets_combinations(direction)
+    for direction in Direction
+}
+
 # Relative coordinates of the vehicle starting zones in the straightforward sections 
 # for the Open challenge rounds.
 vehicle_positions_in_open = [
@@ -568,48 +907,56 @@ vehicle_positions_in_obstacle = [
 ]
 
 # game field image template
-template = np.zeros((height+border*2,width+border*2,3), np.uint8)
+template = np.full((height+border*2,width+border*2), wall_color, np.uint8)
 
 # The game field is white square with the border which represents the outer walls.
 # The color of the border is black.
-template[border:height+border,border:width+border] = (255,255,255)
+template[border:height+border,border:width+border] = mat_color
+
+# All lines of the game mat are collected in one mask and drawn at once.
+grid_lines = np.zeros(template.shape, bool)
 
 # The lines representing arcs in the "Section N"
-template[first_line-(thin_line//2)+border:first_line+(thin_line//2)+border,border+inner_border:width-inner_border+border] = (0,0,0)
-template[second_line-(thin_line//2)+border:second_line+(thin_line//2)+border,border+inner_border:width-inner_border+border] = (0,0,0)
+grid_lines[line_span(first_line, thin_line),border+inner_border:width-inner_border+border] = True
+grid_lines[line_span(second_line, thin_line),border+inner_border:width-inner_border+border] = True
 
 # One line representing the left radiuse of the "Section W", the border of the "Section N" with the central section and the right radius of the "Section E".
-template[inner_border-(thin_line//2)+border:inner_border+(thin_line//2)+border,border:width+border] = (0,0,0)
+grid_lines[line_span(inner_border, thin_line),border:width+border] = True
 
 # The lines representing arcs in the "Section S" 
-template[height-first_line-(thin_line//2)+border:height-first_line+(thin_line//2)+border,border+inner_border:width-inner_border+border] = (0,0,0)
-template[height-second_line-(thin_line//2)+border:height-second_line+(thin_line//2)+border,border+inner_border:width-inner_border+border] = (0,0,0)
+grid_lines[line_span(height-first_line, thin_line),border+inner_border:width-inner_border+border] = True
+grid_lines[line_span(height-second_line, thin_line),border+inner_border:width-inner_border+border] = True
 
 # One line representing the right radius of the "Section W", the border of the "Section S" with the central section and the left radius of the "Section E".
-template[height-inner_border-(thin_line//2)+border:height-inner_border+(thin_line//2)+border,border:width+border] = (0,0,0)
+grid_lines[line_span(height-inner_border, thin_line),border:width+border] = True
 
 # The lines representing arcs in the "Section W"
-template[border+inner_border:height-inner_border+border,first_line-(thin_line//2)+border:first_line+(thin_line//2)+border] = (0,0,0)
-template[border+inner_border:height-inner_border+border,second_line-(thin_line//2)+border:second_line+(thin_line//2)+border] = (0,0,0)
+grid_lines[border+inner_border:height-inner_border+border,line_span(first_line, thin_line)] = True
+grid_lines[border+inner_border:height-inner_border+border,line_span(second_line, thin_line)] = True
 
 # One line representing the left radius of the "Section N", the border of the "Section E" with the central section and the right radius of the "Section S".
-template[border:height+border,inner_border-(thin_line//2)+border:inner_border+(thin_line//2)+border] = (0,0,0)
+grid_lines[border:height+border,line_span(inner_border, thin_line)] = True
 
 # The lines representing arcs in the "Section E"
-template[border+inner_border:height-inner_border+border,width-first_line-(thin_line//2)+border:width-first_line+(thin_line//2)+border] = (0,0,0)
-template[border+inner_border:height-inner_border+border,width-second_line-(thin_line//2)+border:width-second_line+(thin_line//2)+border] = (0,0,0)
+grid_lines[border+inner_border:height-inner_border+border,line_span(width-first_line, thin_line)] = True
+grid_lines[border+inner_border:height-inner_border+border,line_span(width-second_line, thin_line)] = True
 
 # One line representing the right radius of the "Section N", the border of the "Section W" with the central section and the left radius of the "Section S".
-template[border:height+border,width-inner_border-(thin_line//2)+border:width-inner_border+(thin_line//2)+border] = (0,0,0)
+grid_lines[border:height+border,line_span(width-inner_border, thin_line)] = True
 
 # The line representing the central radius of the "Section N"
-template[border:inner_border+border,(width//2)-(thin_line//2)+border:(width//2)+(thin_line//2)+border] = (0,0,0)
+grid_lines[border:inner_border+border,line_span(width//2, thin_line)] = True
 # The line representing the central radius of the "Section S"
-template[height-inner_border+border:height+border,(width//2)-(thin_line//2)+border:(width//2)+(thin_line//2)+border] = (0,0,0)
+grid_lines[height-inner_border+border:height+border,line_span(width//2, thin_line)] = True
 # The line representing the central radius of the "Section W"
-template[(height//2)-(thin_line//2)+border:(height//2)+(thin_line//2)+border,border:inner_border+border] = (0,0,0)
+grid_lines[line_span(height//2, thin_line),border:inner_border+border] = True
 # The line representing the central radius of the "Section E"
-template[(height//2)-(thin_line//2)+border:(height//2)+(thin_line//2)+border,width-inner_border+border:width+border] = (0,0,0)
+grid_lines[line_span(height//2, thin_line),width-inner_border+border:width+border] = True
+
+template[grid_lines] = wall_color
+
+# The template is shared by all requests, so it must not be modified.
+template.flags.writeable = False
 
 def draw_parking_lot_barriers(img, section: Section):
     """
@@ -650,14 +997,14 @@ def draw_parking_lot_barriers(img, section: Section):
         second_barrier_bottom_right[1], second_barrier_bottom_right[0],
         parking_lot_color)
 
-def draw_obstacles_set(img, section: Section, obstacles_set: list[Obstacle]):
+def draw_obstacles_set(img, section: Section, obstacles_set_index: int):
     """
-    Draw a set of obstacles defined by the elements of the obstacles set `obstacles_set`
-    in the straightforward section defined by the given function `section`.
+    Draw a set of obstacles defined by the elements of the obstacles set with the index
+    `obstacles_set_index` in the straightforward section defined by the given function `section`.
     """
 
-    for obstacle in obstacles_set:
-        obstacle.draw(img, section)
+    for region, c in obstacles_sets_regions[(obstacles_set_index, section)]:
+        img[region] = c
 
 def draw_narrow(img, direction: Direction):
     """
@@ -671,72 +1018,152 @@ def draw_narrow(img, direction: Direction):
     axes = (narrow_radius, narrow_radius)
     startA = 180
     endA = -90
+    # Anti-aliasing must stay off: the image holds palette indices, and blending
+    # them would produce indices of unrelated colors along the edges.
     # Draw the arc
-    img = cv2.ellipse(img, img_center, axes, 0, startA, endA, narrow_color, narrow_thickness)
+    img = cv2.ellipse(img, img_center, axes, 0, startA, endA, narrow_color, narrow_thickness, cv2.LINE_8)
 
     # Draw the arrow at the end of the arc
     if Direction.is_cw(direction):
         startP = (img_center[0] - narrow_radius, img_center[1])
-        endP = (img_center[0] - narrow_radius - 30, img_center[1] + 80)
-        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness)
-        endP = (img_center[0] - narrow_radius + 50, img_center[1] + 75)
-        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness)
+        endP = (img_center[0] - narrow_radius - px(30), img_center[1] + px(80))
+        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness, cv2.LINE_8)
+        endP = (img_center[0] - narrow_radius + px(50), img_center[1] + px(75))
+        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness, cv2.LINE_8)
     elif Direction.is_ccw(direction):
         startP = (img_center[0], img_center[1] - narrow_radius)
-        endP = (img_center[0] + 80, img_center[1] - narrow_radius - 30)
-        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness)
-        endP = (img_center[0] + 75, img_center[1] - narrow_radius + 50)
-        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness)
+        endP = (img_center[0] + px(80), img_center[1] - narrow_radius - px(30))
+        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness, cv2.LINE_8)
+        endP = (img_center[0] + px(75), img_center[1] - narrow_radius + px(50))
+        img = cv2.line(img, startP, endP, narrow_color, narrow_thickness, cv2.LINE_8)
+
+# The narrow arc depends only on the driving direction, so it is drawn once on the
+# copies of the template prepared for every challenge type and both directions instead
+# of every request. The inner walls are always in the default position in the Obstacle
+# challenge rounds and do not cross any other element, so they are drawn on its
+# templates too. The inner walls of the Open challenge rounds are random and are drawn
+# over the starting zone, so they are not part of its templates.
+layout_templates = {}
+for direction in Direction:
+    directed_template = template.copy()
+    draw_narrow(directed_template, direction)
+    directed_template.flags.writeable = False
+    layout_templates[(ChallengeType.OPEN, direction)] = directed_template
+
+    obstacle_template = directed_template.copy()
+    default_inner_walls.draw(obstacle_template)
+    obstacle_template.flags.writeable = False
+    layout_templates[(ChallengeType.OBSTACLE, direction)] = obstacle_template
+
+# The images are drawn in the buffers taken from this pool instead of allocating
+# a new copy of the template for every request. The most recently returned buffer
+# is reused first.
+image_pool = LifoQueue()
+
+@contextmanager
+def borrow_image(challenge: ChallengeType, direction: Direction):
+    """
+    Borrow an image buffer from the pool and fill it with the game field template
+    for the given challenge type containing the narrow arc for the given driving direction.
+
+    The buffer is returned to the pool when the context is exited, so the image must
+    not be used after that.
+    """
 
-def draw_scheme_for_final(scheme):
+    try:
+        image = image_pool.get_nowait()
+    except Empty:
+        image = np.empty_like(template)
+    np.copyto(image, layout_templates[(challenge, direction)])
+    try:
+        yield image
+    finally:
+        image_pool.put(image)
+
+class OpenChallengeScheme(NamedTuple):
+    """
+    Represents the random layout of the game field for the Open challenge rounds.
     """
-    Draw the game field for the Obstacle challenge rounds.
 
-    The scheme is a dictionary with the following keys:
-    - start_section: the straightforward section where the starting zone is located
-    - start_zone: the position of the starting zone in the chosen straightforward section
-    - obstacles: a dictionary where keys are indices of the obstacles sets and values
-      are sections where the obstacles are located
-    - parking_section: the section where the parking lot is located
+    # The sides of the game mat where the inner wall is closer to the outer wall
+    inner_walls: frozenset[Section]
+    # The straightforward section where the starting zone is located
+    start_section: Section
+    # The position of the starting zone in the chosen straightforward section
+    start_zone: StartZone
 
-    Returns a 3-dimensional NumPy array (matrix) representing the game field where
-    every pixel is represented by three numbers corresponding to the BGR color.
+class ObstacleChallengeScheme(NamedTuple):
+    """
+    Represents the random layout of the game field for the Obstacle challenge rounds.
+    """
+
+    # The straightforward section where the starting zone is located
+    start_section: Section
+    # The position of the starting zone in the chosen straightforward section
+    start_zone: StartZone
+    # The pairs of the index of the obstacles set and the section where the obstacles are located
+    obstacles: frozenset[tuple[int, Section]]
+    # The section where the parking lot is located
+    parking_section: Section
+
+def draw_scheme_for_open(image: np.ndarray, scheme: OpenChallengeScheme) -> np.ndarray:
+    """
+    Draw the game field for the Open challenge rounds on the image
+    filled with the game field template.
+
+    Returns the image, a 2-dimensional NumPy array (matrix) representing the game field where
+    every pixel is represented by the index of its color in the palette.
     """
 
-    image = template.copy()
-        
     # Create the vehicle starting position object for the given zone
     # and draw it in the chosen straightforward section
-    VehiclePosition(scheme['start_zone']).draw(image, scheme['start_section'])
+    VehiclePosition(scheme.start_zone).draw(image, scheme.start_section)
+
+    # Draw the inner walls
+    InnerWall(scheme.inner_walls).draw(image)
+
+    return image
+
+def draw_scheme_for_final(image: np.ndarray, scheme: ObstacleChallengeScheme) -> np.ndarray:
+    """
+    Draw the game field for the Obstacle challenge rounds on the image
+    filled with the game field template for the Obstacle challenge rounds.
+
+    Returns the image, a 2-dimensional NumPy array (matrix) representing the game field where
+    every pixel is represented by the index of its color in the palette.
+    """
+
+    # Create the vehicle starting position object for the given zone
+    # and draw it in the chosen straightforward section
+    VehiclePosition(scheme.start_zone).draw(image, scheme.start_section)
 
     # Draw the parking lot barriers in the parking section
-    draw_parking_lot_barriers(image, scheme['parking_section'])
+    draw_parking_lot_barriers(image, scheme.parking_section)
 
     # Draw the obstacles in the corresponding sections
-    obstacles_configuration = scheme['obstacles']
-    for obstacles_set_index in obstacles_configuration:
-        draw_obstacles_set(image, obstacles_configuration[obstacles_set_index], obstacles_sets[obstacles_set_index])
+    for obstacles_set_index, section in scheme.obstacles:
+        draw_obstacles_set(image, section, obstacles_set_index)
+
+    # The inner walls in the default position are already drawn on the template.
 
     return image
 
-def randomize_and_draw_layout_for_open(direction: Direction) -> np.ndarray:
+def randomize_scheme_for_open(direction: Direction, rng=random) -> OpenChallengeScheme:
     """
-    Generate the game field for the Open challenge rounds.
+    Choose the random layout of the game field for the Open challenge rounds
+    for the given driving direction.
 
-    Returns a 3-dimensional NumPy array (matrix) representing the game field where
-    every pixel is represented by three numbers corresponding to the BGR color.
+    The random choices are made with `rng`, the `random` module or an instance of
+    `random.Random`.
     """
 
-    # Cannot use list(Section) because elements of Section are functions.
-    sections = [Section.NORTH, Section.WEST, Section.SOUTH, Section.EAST]
-
     # Choose on which sides of the game mat the inner walls should be drawn 
     # closer to the outer walls.
-    inner_walls_config = sample(sections, randint(0, 4))
+    inner_walls_config = rng.sample(straightforward_sections, rng.randint(0, 4))
     inner_walls = InnerWall(inner_walls_config)
 
     # Choose the straightforward section where the starting zone is located.
-    starting_section = choice(sections)
+    starting_section = rng.choice(straightforward_sections)
 
     # If the inner wall in the starting section is closer to the outer wall,
     # the starting zone could be only one of the four available zones in
@@ -747,164 +1174,355 @@ def randomize_and_draw_layout_for_open(direction: Direction) -> np.ndarray:
     else:
         allowed_zones = list(StartZone)
     # Choose the starting zone within the allowed zones.
-    starting_zone = choice(allowed_zones)
-
-    image = template.copy()
-
-    # Create the vehicle starting position object for the given zone
-    # and draw it in the chosen straightforward section
-    VehiclePosition(starting_zone).draw(image, starting_section)
+    starting_zone = rng.choice(allowed_zones)
 
-    # Draw the inner walls
-    inner_walls.draw(image)
-
-    # Draw the narrow arc in the central section
-    draw_narrow(image, direction)
-
-    return image
+    return OpenChallengeScheme(frozenset(inner_walls_config), starting_section, starting_zone)
         
-def randomize_and_draw_layout_for_obstacle(direction: Direction) -> np.ndarray:
+def randomize_scheme_for_obstacle(direction: Direction, rng=random) -> ObstacleChallengeScheme:
     """
-    Generate the game field for the Obstacle challenge rounds.
+    Choose the random layout of the game field for the Obstacle challenge rounds
+    for the given driving direction.
 
-    Returns a 3-dimensional NumPy array (matrix) representing the game field where
-    every pixel is represented by three numbers corresponding to the BGR color.
+    The random choices are made with `rng`, the `random` module or an instance of
+    `random.Random`.
     """
 
-    # The set of intersections that will be in front of the vehicle in the start zone
-    # for the given driving direction.
-    forbidden_intersections = forbidden_intersections_in_start_zone[direction]
-
-    # Look for the obstacles sets that satisfy the conditions:
-    # - the difference between the number of green and red obstacles is not greater than one
-    # - the total number of obstacles is at least 5
-    # - there is at least one valid start zone for the given combination of obstacles
-    satisfied = False
-    while not satisfied:
-        # Choose the index of the mandatory obstacles set.
-        mandatory_set_color = choice([Color.GREEN, Color.RED])
-        mandatory_obstacles_set = mandatory_obstacles_sets[mandatory_set_color]
-
-        # Choose the index of the required obstacles set.
-        required_obstacles_set = choice(required_obstacles_sets)
-
-        # Choose the index of the obstacles set for one of two remaining sections.
-        os1 = mandatory_obstacles_set
-        while os1 == required_obstacles_set or os1 == mandatory_obstacles_set:
-            os1 = randint(0, len(obstacles_sets)-1)
-
-        # Choose the index of the obstacles set for the last remaining section.
-        os2 = mandatory_obstacles_set
-        while os2 == required_obstacles_set or os2 == mandatory_obstacles_set or os2 == os1:
-            os2 = randint(0, len(obstacles_sets)-1)
-
-        chosen_obstacles_sets_indices = [mandatory_obstacles_set, required_obstacles_set, os1, os2]
-
-        # Calculate the number of obstacles, the number of green and red obstacles and
-        # the forbidden start zones for choosen obstacles sets.
-        forbidden_start_zones = {}
-        obstacles_set_conflicting_with_parking_section = set()
-        obstacles_amount = 0
-        green_amount = 0
-        red_amount = 0
-        for obstacles_set_index in chosen_obstacles_sets_indices:
-            one_obstacles_set = obstacles_sets[obstacles_set_index]
-
-            obstacles_amount = obstacles_amount + len(one_obstacles_set)
-
-            forbidden_start_zones[obstacles_set_index] = set()
-            for one_obstacle in one_obstacles_set:
-                if one_obstacle.is_green():
-                    green_amount = green_amount + 1
-                elif one_obstacle.is_red():
-                    red_amount = red_amount + 1
-                else:
-                    raise ValueError("Unknown obstacle color")
-                
-                # Check if the current obstacle would be in front of the vehicle
-                # for each possible starting zone in this section
-                for zone in forbidden_intersections:
-                    if one_obstacle.position in forbidden_intersections[zone]:
-                        forbidden_start_zones[obstacles_set_index].add(zone)
-
-                # Check if the current obstacle's position is suitable for the
-                # section where the parking lot is located.
-                for intersection in forbidden_intersections_in_parking_section:
-                    if one_obstacle.position == intersection:
-                        obstacles_set_conflicting_with_parking_section.add(obstacles_set_index)
-
-        # Remove obstacle sets where both possible start zones are forbidden, keeping
-        # only sets that have at least one valid start zone.
-        for obstacles_set_index in forbidden_start_zones:
-            if len(forbidden_start_zones[obstacles_set_index]) == 2:
-                del forbidden_start_zones[obstacles_set_index]
-
-        # Get all obstacle sets that are suitable for the parking section.
-        obstacles_set_suitable_for_parking_section = set(chosen_obstacles_sets_indices) - \
-            obstacles_set_conflicting_with_parking_section
-
-        # Stops to look for the obstacles sets if the conditions are satisfied:
-        # - the difference between the number of green and red obstacles is not greater than one
-        # - the total number of obstacles is at least 5
-        # - there is at least one valid start zone for the given combination of obstacles
-        # - there is at least one obstacle set that is suitable for the parking section
-        satisfied = (abs(green_amount - red_amount) <= 1) and \
-            (obstacles_amount > 4) and \
-            (len(forbidden_start_zones) > 0) and \
-            (len(obstacles_set_suitable_for_parking_section) > 0)
-
-    # Cannot use list(Section) because elements of Section are functions.
-    sections = [Section.NORTH, Section.WEST, Section.SOUTH, Section.EAST]
+    # Choose the obstacles sets among all combinations that satisfy the conditions
+    # of the randomization process.
+    combination = rng.choice(valid_obstacles_sets_combinations[direction])
+    chosen_obstacles_sets_indices = combination.obstacles_sets
+    start_zones = combination.start_zones
+    obstacles_set_suitable_for_parking_section = combination.suitable_for_parking_section
 
     # Randomly assign each obstacle set to a unique section of the game field
-    shuffled_sections = sample(sections, 4)
-    sections_for_obstacles_sets = {}
-    for obstacles_set_index in chosen_obstacles_sets_indices:
-        sections_for_obstacles_sets[obstacles_set_index] = shuffled_sections.pop()
+    sections_for_obstacles_sets = dict(zip(chosen_obstacles_sets_indices,
+        rng.choice(straightforward_sections_permutations)))
 
     # Choose one of the obstacle sets that has at least one valid start zone.
-    obstacles_set_in_start_section = choice(list(forbidden_start_zones.keys()))
+    obstacles_set_in_start_section = rng.choice(list(start_zones))
     # Choose the section where the chosen obstacle set is located.
     start_section = sections_for_obstacles_sets[obstacles_set_in_start_section]
 
     # Choose one of the obstacle sets that is suitable for the parking section.
-    obstacles_set_in_parking_section = choice(list(obstacles_set_suitable_for_parking_section))
+    obstacles_set_in_parking_section = rng.choice(obstacles_set_suitable_for_parking_section)
     # Choose the section where the chosen obstacle set is located.
     parking_section = sections_for_obstacles_sets[obstacles_set_in_parking_section]
 
     # Choose one of the valid start zones for the chosen obstacle set.
-    start_zone = choice(list(set([StartZone.Z3, StartZone.Z4]) - forbidden_start_zones[obstacles_set_in_start_section]))
+    start_zone = rng.choice(start_zones[obstacles_set_in_start_section])
 
-    scheme = {
-        'start_section': start_section,
-        'start_zone': start_zone,
-        'obstacles': sections_for_obstacles_sets,
-        'parking_section': parking_section
-    }
-    image = draw_scheme_for_final(scheme)
-
-    # Draw the inner walls
-    InnerWall().draw(image)
-    
-    # Draw the narrow arc in the central section
-    draw_narrow(image, direction)
+    return ObstacleChallengeScheme(start_section, start_zone,
+        frozenset(sections_for_obstacles_sets.items()), parking_section)
 
-    return image
+# The functions to choose the random layout of the game field and to draw it
+# for every challenge type.
+challenge_schemes = {
+    ChallengeType.OPEN: (randomize_scheme_for_open, draw_scheme_for_open),
+    ChallengeType.OBSTACLE: (randomize_scheme_for_obstacle, draw_scheme_for_final)
+}
 
 #### HTTP Content related
 
-def generate_image(img):
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """
+    Build a PNG chunk of the given type: the length, the type, the data and the CRC.
+    """
+
+    return struct.pack('>I', len(data)) + chunk_type + data + \
+        struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)))
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# The palette chunk is the same for all images. PNG stores the colors in the RGB order.
+png_palette = png_chunk(b'PLTE', b''.join(bytes(reversed(bgr)) for bgr in palette))
+
+png_end = png_chunk(b'IEND', b'')
+
+# The image data is compressed by bands of scanlines in parallel threads (zlib releases
+# the GIL). Every band is compressed independently and the results are concatenated into
+# one DEFLATE stream in the same way as it is done by pigz and mtpng.
+# There is no use for more threads than the bands of one image: every gunicorn worker
+# has its own pool, and the threads of all workers share the same cores.
+png_band_height = 256
+png_compression_threads = min(os.cpu_count() or 1, math.ceil(template.shape[0] / png_band_height))
+png_compression_pool = ThreadPoolExecutor(max_workers=png_compression_threads)
+
+def compress_band(band: np.ndarray, last: bool) -> bytes:
+    """
+    Compress a band of scanlines to a part of the raw DEFLATE stream.
+
+    The band is ended by the full flush, so the next band can be appended to it.
+    The stream is finished only after the last band.
+    """
+
+    compressor = zlib.compressobj(1, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zlib.Z_RLE)
+    return compressor.compress(band) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+def compress_scanlines(scanlines: np.ndarray) -> bytes:
+    """
+    Compress the scanlines to the zlib stream stored in the IDAT chunk.
+    """
+
+    bands = range(0, len(scanlines), png_band_height)
+    compress = lambda start: compress_band(scanlines[start:start+png_band_height], start == bands[-1])
+    parts = png_compression_pool.map(compress, bands)
+
+    # The zlib header for DEFLATE with the 32K window and the fastest compression
+    # followed by the compressed data and the Adler-32 checksum of the uncompressed data.
+    return b'\x78\x01' + b''.join(parts) + struct.pack('>I', zlib.adler32(scanlines))
+
+def encode_png(img: np.ndarray) -> bytes:
     """
-    Encode the image from a 3-dimensional NumPy array to the PNG format
-    and return it as a HTTP response.
+    Encode the image from a 2-dimensional NumPy array of palette indices to the PNG format.
+
+    The image is stored as the 8-bit palette PNG, so it is not expanded to BGR colors.
+    Every scanline uses no filter and the data is compressed with the RLE strategy which
+    suits the large areas of the same color.
     """
 
-    res, im_png = cv2.imencode('.png', img)
-    image = im_png.tobytes()
-    response = make_response(image)
-    response.headers.set('Content-Type', 'image/png')
-    response.headers.set('Cache-Control', 'no-store')
-    return response
+    img_height, img_width = img.shape
+
+    # Every scanline starts with the filter type byte, zero means no filter.
+    scanlines = np.zeros((img_height, img_width + 1), np.uint8)
+    scanlines[:, 1:] = img
+
+    data = compress_scanlines(scanlines)
+
+    # 8 bits per pixel, color type 3 (palette), default compression, filtering and no interlacing
+    header = struct.pack('>IIBBBBB', img_width, img_height, 8, 3, 0, 0, 0)
+    return b''.join([png_signature, png_chunk(b'IHDR', header), png_palette,
+                     png_chunk(b'IDAT', data), png_end])
+
+# The number of the PNG images of the recently drawn layouts kept in the cache.
+png_cache_size = 512
+
+@lru_cache(maxsize=png_cache_size)
+def render_scheme(challenge: ChallengeType, direction: Direction, scheme) -> bytes:
+    """
+    Draw the layout described by the scheme for the given challenge type and driving
+    direction and return it as the PNG image.
+
+    The number of different layouts is limited, so the images of the recently drawn
+    schemes are kept and returned when the same scheme is chosen again.
+    """
+
+    draw_scheme = challenge_schemes[challenge][1]
+    with borrow_image(challenge, direction) as image:
+        return encode_png(draw_scheme(image, scheme))
+
+def generate_layout(challenge: ChallengeType, direction: Direction, rng=random) -> bytes:
+    """
+    Generate the random layout for the given challenge type and driving direction
+    and return it as the PNG image.
+
+    The random choices are made with `rng`, the `random` module or an instance of
+    `random.Random`.
+    """
+
+    randomize_scheme = challenge_schemes[challenge][0]
+    return render_scheme(challenge, direction, randomize_scheme(direction, rng))
+
+# The layouts are generated in advance by background threads, one thread per the challenge
+# type and the driving direction, so the request only takes the ready PNG image from the
+# queue. The layout is generated by the request itself if the queue is empty.
+prefetched_layouts_size = 8
+prefetched_layouts = {}
+prefetched_layouts_lock = Lock()
+prefetching_threads = []
+# Tells the threads preparing the layouts to finish.
+prefetching_stopped = Event()
+# How often a thread waiting for the free place in the full queue checks if it must
+# finish, in seconds.
+prefetching_stop_check_interval = 0.5
+
+def prefetch_layouts(challenge: ChallengeType, direction: Direction, layouts: Queue):
+    """
+    Keep the queue of the prepared layouts full until the prefetching is stopped.
+    It waits while the queue is full.
+    """
+
+    while not prefetching_stopped.is_set():
+        layout = generate_layout(challenge, direction)
+        while not prefetching_stopped.is_set():
+            try:
+                layouts.put(layout, timeout=prefetching_stop_check_interval)
+                break
+            except Full:
+                pass
+
+def stop_prefetching():
+    """
+    Stop the threads preparing the layouts and wait until they finish the layouts
+    they are drawing.
+    """
+
+    prefetching_stopped.set()
+    with prefetched_layouts_lock:
+        threads = list(prefetching_threads)
+    for thread in threads:
+        thread.join()
+
+# The compression pool does not accept new tasks once the interpreter exits, so the
+# prefetching is stopped before the pool is shut down. The exit functions of the threading
+# module are called in the reverse order of registration, that is before the shutdown of
+# the pool registered by concurrent.futures, while the functions registered by atexit are
+# called only after all of them.
+threading._register_atexit(stop_prefetching)
+
+def start_prefetching(challenge: ChallengeType, direction: Direction) -> Queue:
+    """
+    Create the queue of the prepared layouts and start the thread filling it.
+
+    The thread is started by the first request rather than at import, so it runs in
+    the process which serves the requests.
+    """
+
+    with prefetched_layouts_lock:
+        key = (challenge, direction)
+        layouts = prefetched_layouts.get(key)
+        if layouts is None:
+            layouts = Queue(maxsize=prefetched_layouts_size)
+            prefetched_layouts[key] = layouts
+            if prefetched_layouts_size > 0 and not prefetching_stopped.is_set():
+                thread = Thread(target=prefetch_layouts, args=(challenge, direction, layouts),
+                                daemon=True)
+                thread.start()
+                prefetching_threads.append(thread)
+    return layouts
+
+def take_layout(challenge: ChallengeType, direction: Direction, seed: int = None) -> bytes:
+    """
+    Take the PNG image of the layout prepared in advance or generate it if there is
+    no prepared layout yet.
+
+    If `seed` is given, the layout generated from this seed is returned instead.
+    """
+
+    if seed is not None:
+        return generate_layout(challenge, direction, random.Random(seed))
+
+    layouts = prefetched_layouts.get((challenge, direction))
+    if layouts is None:
+        layouts = start_prefetching(challenge, direction)
+    try:
+        return layouts.get_nowait()
+    except Empty:
+        return generate_layout(challenge, direction)
+
+# The headers of the responses with the random and the reproducible layouts.
+random_image_headers = {'Cache-Control': 'no-cache'}
+reproducible_image_headers = {'Cache-Control': 'public, max-age=3600'}
+
+def make_cached_response(body: bytes, mimetype: str, reproducible: bool = False, headers: dict = None):
+    """
+    Return the HTTP response with the given body and the caching headers.
+
+    The body is tagged with a hash of its content. A client that revalidates
+    a body it already has gets an empty "304 Not Modified" response instead.
+    Every random layout is new, so a client must not reuse a body it has without
+    revalidating it: a page reload shows a new layout. The `reproducible` layouts,
+    generated from the seed given in the request, can be reused by clients and
+    proxies for an hour. `headers` are added to the caching headers.
+    """
+
+    response = Response(body, mimetype=mimetype,
+        headers=reproducible_image_headers if reproducible else random_image_headers)
+    if headers:
+        response.headers.update(headers)
+    response.set_etag(hashlib.blake2b(body, digest_size=10).hexdigest())
+    return response.make_conditional(request)
+
+def generate_image(image: bytes, reproducible: bool = False):
+    """
+    Return the PNG image as a HTTP response.
+    """
+
+    return make_cached_response(image, 'image/png', reproducible)
+
+# The largest number of the layouts returned in one archive. The layouts of an archive
+# are drawn and encoded by the request itself. Every layout which is not in the cache of
+# the PNG images takes about 35 milliseconds with one pixel per millimeter (3 milliseconds
+# with MM_PER_PIXEL=3), so the largest archive takes about 1 second of CPU time of the worker.
+max_layouts_in_archive = 32
+
+def generate_layouts(challenge: ChallengeType, direction: Direction, count: int, seed: int = None) -> list[bytes]:
+    """
+    Generate the PNG images of `count` layouts for the given challenge type and driving direction.
+
+    If `seed` is given, the layouts are generated one after another from this seed,
+    so the same seed and count give the same layouts.
+
+    The layouts prepared in advance are not used: they are left for the requests of
+    single layouts.
+    """
+
+    rng = random if seed is None else random.Random(seed)
+    return [generate_layout(challenge, direction, rng) for _ in range(count)]
+
+def archive_layouts(layouts: list[bytes]) -> bytes:
+    """
+    Pack the PNG images of the layouts into a ZIP archive.
+
+    The images are already compressed, so they are stored as they are. The
+    timestamps of the files are fixed, so the same layouts give the same archive.
+    """
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zip_file:
+        for number, layout in enumerate(layouts, 1):
+            zip_file.writestr(zipfile.ZipInfo(f'layout-{number:03}.png'), layout)
+    return archive.getvalue()
+
+def generate_archive(archive: bytes, name: str, reproducible: bool = False):
+    """
+    Return the ZIP archive with the layouts as a HTTP response offering to save it
+    as the file `name`.
+    """
+
+    return make_cached_response(archive, 'application/zip', reproducible,
+        {'Content-Disposition': f'attachment; filename={name}'})
+
+def get_integer_argument(name: str) -> int | None:
+    """
+    Return the integer value of the request parameter `name` or None if it is not given.
+
+    A value which is not a non-negative decimal integer is rejected with the "400 Bad Request"
+    response instead of being ignored. Negative numbers are rejected, because `random.Random`
+    is seeded with the absolute value of the seed and the negative seed would give the same
+    layout as the positive one.
+    """
+
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not re.fullmatch(r'[0-9]+', value):
+        abort(400, f'The {name} parameter must be a non-negative integer')
+    try:
+        return int(value)
+    except ValueError:
+        # The number is longer than Python converts from a string.
+        abort(400, f'The {name} parameter is too long')
+
+def generate_response(challenge: ChallengeType, direction: Direction, name: str):
+    """
+    Return the response for the layout request for the given challenge type and
+    driving direction.
+
+    The PNG image of one layout is returned by default. If the number of the layouts
+    is given as the `n` parameter of the request, they are returned in the ZIP archive
+    named after `name`. The layouts are reproducible if the `seed` parameter is given.
+    """
+
+    seed = get_integer_argument('seed')
+    count = get_integer_argument('n')
+    if count is None:
+        layout = take_layout(challenge, direction, seed)
+        return generate_image(layout, seed is not None)
+
+    if not 1 <= count <= max_layouts_in_archive:
+        abort(400, f'The number of the layouts must be from 1 to {max_layouts_in_archive}')
+    layouts = generate_layouts(challenge, direction, count, seed)
+    return generate_archive(archive_layouts(layouts), f'{name}.zip', seed is not None)
 
 #### HTTP endpoints
 
@@ -914,27 +1532,19 @@ def index():
 
 @app.route('/qualification/cw')
 def generate_qualification_cw():
-    layout = randomize_and_draw_layout_for_open(Direction.CW)
-    response = generate_image(layout)
-    return response
+    return generate_response(ChallengeType.OPEN, Direction.CW, 'qualification-cw')
 
 @app.route('/qualification/ccw')
 def generate_qualification_ccw():
-    layout = randomize_and_draw_layout_for_open(Direction.CCW)
-    response = generate_image(layout)
-    return response
+    return generate_response(ChallengeType.OPEN, Direction.CCW, 'qualification-ccw')
 
 @app.route('/final/cw')
 def generate_final_cw():
-    layout = randomize_and_draw_layout_for_obstacle(Direction.CW)
-    response = generate_image(layout)
-    return response
+    return generate_response(ChallengeType.OBSTACLE, Direction.CW, 'final-cw')
 
 @app.route('/final/ccw')
 def generate_final_ccw():
-    layout = randomize_and_draw_layout_for_obstacle(Direction.CCW)
-    response = generate_image(layout)
-    return response
+    return generate_response(ChallengeType.OBSTACLE, Direction.CCW, 'final-ccw')
 
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Check the ZIP archives with several layouts returned for the `n` parameter of the requests.
+"""
+
+import io
+import zipfile
+
+import pytest
+
+import app
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def archive_names(data: bytes) -> list[str]:
+    return zipfile.ZipFile(io.BytesIO(data)).namelist()
+
+def test_archive_contains_requested_number_of_layouts(client):
+    response = client.get('/qualification/ccw?n=3')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=qualification-ccw.zip'
+    assert archive_names(response.data) == ['layout-001.png', 'layout-002.png', 'layout-003.png']
+
+def test_seeded_archive_starts_with_seeded_layout(client):
+    archive = client.get('/final/cw?n=2&seed=7')
+
+    assert archive.data == client.get('/final/cw?n=2&seed=7').data
+    layout = zipfile.ZipFile(io.BytesIO(archive.data)).read('layout-001.png')
+    assert layout == client.get('/final/cw?seed=7').data
+
+@pytest.mark.parametrize('count', ['abc', '1.5', '', '-1', '0', str(app.max_layouts_in_archive + 1)])
+def test_invalid_number_of_layouts_is_rejected(client, count):
+    assert client.get('/final/cw', query_string={'n': count}).status_code == 400
+
+@pytest.mark.parametrize('path', ['/final/ccw?seed=3', '/final/ccw?seed=3&n=2'])
+def test_image_and_archive_are_cached_alike(client, path):
+    response = client.get(path)
+
+    assert response.headers['Cache-Control'] == 'public, max-age=3600'
+    revalidated = client.get(path, headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
@@ -0,0 +1,57 @@
+"""
+Check that the PNG images written by the app decode back to the drawn layouts.
+"""
+
+import random
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import app
+
+palette_colors = np.array(app.palette, np.uint8)
+
+def decode_png(png: bytes) -> np.ndarray:
+    decoded = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+    assert decoded is not None, 'The PNG image does not decode'
+    return decoded
+
+def draw_layout(challenge: app.ChallengeType, direction: app.Direction, seed: int) -> np.ndarray:
+    randomize_scheme, draw_scheme = app.challenge_schemes[challenge]
+    scheme = randomize_scheme(direction, random.Random(seed))
+    with app.borrow_image(challenge, direction) as image:
+        return draw_scheme(image, scheme).copy()
+
+@pytest.mark.parametrize('challenge', list(app.ChallengeType))
+@pytest.mark.parametrize('direction', list(app.Direction))
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_png_decodes_to_drawn_layout(challenge, direction, seed):
+    image = draw_layout(challenge, direction, seed)
+
+    decoded = decode_png(app.encode_png(image))
+
+    np.testing.assert_array_equal(decoded, palette_colors[image])
+
+@pytest.mark.parametrize('band_height', [1, 100, 10000])
+def test_png_decodes_with_any_band_height(monkeypatch, band_height):
+    # The image is split into one band per scanline, into several bands with a
+    # shorter last one and into a single band.
+    monkeypatch.setattr(app, 'png_band_height', band_height)
+    image = draw_layout(app.ChallengeType.OBSTACLE, app.Direction.CW, 0)
+
+    decoded = decode_png(app.encode_png(image))
+
+    np.testing.assert_array_equal(decoded, palette_colors[image])
+
+def test_png_header_describes_palette_image():
+    image = draw_layout(app.ChallengeType.OPEN, app.Direction.CCW, 0)
+
+    png = app.encode_png(image)
+
+    assert png.startswith(app.png_signature)
+    assert png[12:16] == b'IHDR'
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', png[16:26])
+    assert (width, height) == (image.shape[1], image.shape[0])
+    assert (bit_depth, color_type) == (8, 3)
@@ -0,0 +1,84 @@
+"""
+Check that a seed gives the same layout in every process and in every version of the app.
+
+The layouts served for the `seed` parameter of the requests are defined by the order and
+the arguments of the random choices made by the randomization functions and by the order
+of the lists they choose from. The schemes below were chosen for these seeds; if a test
+fails, a change of the randomization broke the layouts of the existing seeds.
+"""
+
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import app
+from app import ChallengeType, Direction, Section, StartZone, OpenChallengeScheme, ObstacleChallengeScheme
+
+reference_seeded_schemes = {
+    (ChallengeType.OPEN, Direction.CW, 1): OpenChallengeScheme(frozenset([Section.NORTH]), Section.SOUTH, StartZone.Z1),
+    (ChallengeType.OPEN, Direction.CCW, 1): OpenChallengeScheme(frozenset([Section.NORTH]), Section.SOUTH, StartZone.Z1),
+    (ChallengeType.OPEN, Direction.CW, 2): OpenChallengeScheme(frozenset(), Section.NORTH, StartZone.Z1),
+    (ChallengeType.OPEN, Direction.CCW, 2): OpenChallengeScheme(frozenset(), Section.NORTH, StartZone.Z1),
+    (ChallengeType.OPEN, Direction.CW, 3): OpenChallengeScheme(frozenset([Section.WEST]), Section.SOUTH, StartZone.Z5),
+    (ChallengeType.OPEN, Direction.CCW, 3): OpenChallengeScheme(frozenset([Section.WEST]), Section.SOUTH, StartZone.Z5),
+    (ChallengeType.OPEN, Direction.CW, 42): OpenChallengeScheme(frozenset(), Section.NORTH, StartZone.Z6),
+    (ChallengeType.OPEN, Direction.CCW, 42): OpenChallengeScheme(frozenset(), Section.NORTH, StartZone.Z6),
+    (ChallengeType.OPEN, Direction.CW, 2024): OpenChallengeScheme(frozenset([Section.WEST, Section.SOUTH, Section.EAST]), Section.WEST, StartZone.Z3),
+    (ChallengeType.OPEN, Direction.CCW, 2024): OpenChallengeScheme(frozenset([Section.WEST, Section.SOUTH, Section.EAST]), Section.WEST, StartZone.Z3),
+    (ChallengeType.OBSTACLE, Direction.CW, 1): ObstacleChallengeScheme(Section.EAST, StartZone.Z3, frozenset([(3, Section.WEST), (8, Section.EAST), (22, Section.NORTH), (27, Section.SOUTH)]), Section.WEST),
+    (ChallengeType.OBSTACLE, Direction.CCW, 1): ObstacleChallengeScheme(Section.EAST, StartZone.Z4, frozenset([(3, Section.WEST), (8, Section.EAST), (22, Section.NORTH), (27, Section.SOUTH)]), Section.WEST),
+    (ChallengeType.OBSTACLE, Direction.CW, 2): ObstacleChallengeScheme(Section.NORTH, StartZone.Z3, frozenset([(8, Section.NORTH), (15, Section.WEST), (20, Section.EAST), (21, Section.SOUTH)]), Section.EAST),
+    (ChallengeType.OBSTACLE, Direction.CCW, 2): ObstacleChallengeScheme(Section.NORTH, StartZone.Z4, frozenset([(8, Section.NORTH), (15, Section.WEST), (20, Section.EAST), (21, Section.SOUTH)]), Section.EAST),
+    (ChallengeType.OBSTACLE, Direction.CW, 3): ObstacleChallengeScheme(Section.NORTH, StartZone.Z4, frozenset([(8, Section.EAST), (18, Section.SOUTH), (22, Section.NORTH), (31, Section.WEST)]), Section.NORTH),
+    (ChallengeType.OBSTACLE, Direction.CCW, 3): ObstacleChallengeScheme(Section.NORTH, StartZone.Z3, frozenset([(8, Section.EAST), (18, Section.SOUTH), (22, Section.NORTH), (31, Section.WEST)]), Section.NORTH),
+    (ChallengeType.OBSTACLE, Direction.CW, 42): ObstacleChallengeScheme(Section.NORTH, StartZone.Z3, frozenset([(0, Section.EAST), (9, Section.NORTH), (22, Section.WEST), (27, Section.SOUTH)]), Section.WEST),
+    (ChallengeType.OBSTACLE, Direction.CCW, 42): ObstacleChallengeScheme(Section.NORTH, StartZone.Z4, frozenset([(0, Section.EAST), (9, Section.NORTH), (22, Section.WEST), (27, Section.SOUTH)]), Section.WEST),
+    (ChallengeType.OBSTACLE, Direction.CW, 2024): ObstacleChallengeScheme(Section.SOUTH, StartZone.Z4, frozenset([(3, Section.WEST), (9, Section.NORTH), (20, Section.SOUTH), (21, Section.EAST)]), Section.EAST),
+    (ChallengeType.OBSTACLE, Direction.CCW, 2024): ObstacleChallengeScheme(Section.SOUTH, StartZone.Z3, frozenset([(3, Section.WEST), (9, Section.NORTH), (20, Section.SOUTH), (21, Section.EAST)]), Section.EAST),
+}
+
+@pytest.mark.parametrize('challenge, direction, seed', list(reference_seeded_schemes))
+def test_seed_gives_reference_scheme(challenge, direction, seed):
+    randomize_scheme = app.challenge_schemes[challenge][0]
+
+    scheme = randomize_scheme(direction, random.Random(seed))
+
+    assert scheme == reference_seeded_schemes[(challenge, direction, seed)]
+
+def seeded_layout_digest(hash_seed: str) -> str:
+    """
+    Return the digest of the seeded layouts generated in a new process with the given
+    seed of the Python hashes, which changes the order of the elements in sets.
+    """
+
+    script = ('import hashlib, random, app\n'
+              'layouts = [app.generate_layout(c, d, random.Random(s))\n'
+              '           for c in app.ChallengeType for d in app.Direction for s in range(5)]\n'
+              'print(hashlib.blake2b(b"".join(layouts)).hexdigest())\n')
+    env = dict(os.environ, PYTHONHASHSEED=hash_seed, MM_PER_PIXEL='3')
+    result = subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return result.stdout.split()[-1]
+
+def test_seed_gives_same_layout_in_every_process():
+    assert seeded_layout_digest('1') == seeded_layout_digest('2')
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def test_seed_gives_same_image(client):
+    first = client.get('/final/cw?seed=42')
+    second = client.get('/final/cw?seed=42')
+
+    assert first.status_code == 200
+    assert first.data == second.data
+    assert first.headers['Cache-Control'] == 'public, max-age=3600'
+
+@pytest.mark.parametrize('seed', ['-42', 'abc', '1.5', '', ' 1', '1_0', '9' * 5000])
+def test_invalid_seed_is_rejected(client, seed):
+    assert client.get('/final/cw', query_string={'seed': seed}).status_code == 400